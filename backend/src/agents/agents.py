@@ -1,7 +1,16 @@
+import httpx
+import litellm
 from crewai import Agent
 
 MODEL_ID = "openrouter/openai/gpt-4o-mini"
 
+# Agent calls run synchronously on worker threads; share one pooled client so
+# OpenRouter connections are kept alive between calls instead of re-handshaking
+litellm.client_session = httpx.Client(
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+    timeout=httpx.Timeout(600.0, connect=10.0),
+)
+
 readability_agent = Agent(
     role="Readability Reviewer",
     goal="Identify readability issues in the changed code segments",
@@ -57,6 +66,20 @@ security_agent = Agent(
 )
 
 
+multi_reviewer_agent = Agent(
+    role="Multi-Aspect Reviewer",
+    goal="Review changed code for readability, logic, performance and security issues in one pass",
+    backstory=(
+        "You are a senior engineer who covers every review angle at once: "
+        "clarity, correctness, efficiency, and security. You keep findings "
+        "for each aspect separate so they can be reported individually."
+    ),
+    llm=MODEL_ID,
+    allow_delegation=False,
+    verbose=False,
+)
+
+
 consolidation_agent = Agent(
     role="Consolidation Reviewer",
     goal="Merge and deduplicate findings from all other agents",
@@ -1,24 +1,29 @@
+import asyncio
+import hashlib
 import os
+from contextlib import asynccontextmanager
 from pathlib import Path
 from datetime import datetime, timezone
+from typing import Any, Dict
 
 from dotenv import load_dotenv
 
+# Must run before the agents are imported: they are built at import time
+# and need the key (load_dotenv already exports it to os.environ)
 load_dotenv(Path(__file__).parent / ".env")
-openrouter_key = os.getenv("OPENROUTER_API_KEY")
-if not openrouter_key:
+if not os.getenv("OPENROUTER_API_KEY"):
     raise RuntimeError("OPENROUTER_API_KEY not found in environment")
 
-os.environ["OPENROUTER_API_KEY"] = openrouter_key
-
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from src.models.diff import DiffRequest, PRReviewRequest
-from src.models.review import ReviewResponse
+from src.models.review import ReviewComment, ReviewResponse
 from src.models.errors import ErrorResponse, ErrorDetail
-from src.services.orchestrator import run_review_pipeline
+from src.services.llm_cache import llm_cache
+from src.services.orchestrator import load_tokenizer, run_review_pipeline_async, shutdown_agent_pool
 from src.services.github_service import (
+    close_client,
     fetch_pr_diff, 
     GitHubAPIError,
     PRNotFoundError,
@@ -28,14 +33,35 @@ from src.services.github_service import (
     BinaryDiffError,
     NetworkError
 )
-from src.utils.diff_parser import parse_unified_diff
+from src.utils.diff_parser import has_binary_markers, parse_unified_diff_to_dict
 from src.utils.logger import setup_logger, log_with_context
+from src.utils.singleflight import SingleFlight
 
 logger = setup_logger(__name__)
 
-app = FastAPI(title="PR Review Agent", version="0.1.0")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Load the tokenizer on startup; release shared resources on shutdown."""
+    await asyncio.to_thread(load_tokenizer)
+    yield
+    # Waits for in-flight kickoffs, so keep it off the event loop
+    await asyncio.to_thread(shutdown_agent_pool)
+    await close_client()
+    await llm_cache.close()
+
+
+app = FastAPI(
+    title="PR Review Agent",
+    version="0.1.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
+)
 startup_time = datetime.now(timezone.utc)
 
+# In-flight /review/pr runs, keyed by PR and token
+_pr_reviews = SingleFlight()
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -72,9 +98,16 @@ async def github_api_error_handler(request: Request, exc: GitHubAPIError):
         )
     )
     
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=status_code,
-        content=error_response.model_dump()
+        content=error_response.model_dump(mode="json")
+    )
+
+
+def _build_review_response(review_output: Dict[str, Any]) -> ReviewResponse:
+    """Wrap pipeline comments without re-validation; the pipeline already validated them."""
+    return ReviewResponse.model_construct(
+        comments=[ReviewComment.model_construct(**c) for c in review_output["comments"]]
     )
 
 
@@ -108,7 +141,7 @@ async def review_diff(request: DiffRequest) -> ReviewResponse:
             )
         
         # Check for binary files
-        if "Binary files" in request.diff or "GIT binary patch" in request.diff:
+        if has_binary_markers(request.diff):
             raise HTTPException(
                 status_code=422,
                 detail={
@@ -120,10 +153,10 @@ async def review_diff(request: DiffRequest) -> ReviewResponse:
                 }
             )
         
-        parsed = parse_unified_diff(request.diff)
+        structured_diff = parse_unified_diff_to_dict(request.diff)
         
         # Check if parsing yielded any files
-        if not parsed:
+        if not structured_diff["files"]:
             raise HTTPException(
                 status_code=422,
                 detail={
@@ -135,22 +168,10 @@ async def review_diff(request: DiffRequest) -> ReviewResponse:
                 }
             )
         
-        files = [
-            {
-                "file": fd.file,
-                "changes": [
-                    {"type": c.type, "line": c.line, "content": c.content}
-                    for c in fd.changes
-                ],
-            }
-            for fd in parsed
-        ]
-
-        structured_diff = {"files": files}
-        review_output = run_review_pipeline(structured_diff)
+        review_output = await run_review_pipeline_async(structured_diff)
 
         # Return validated Pydantic response
-        response = ReviewResponse(**review_output)
+        response = _build_review_response(review_output)
         
         log_with_context(
             logger, "info", "Diff review completed successfully",
@@ -180,6 +201,32 @@ async def review_diff(request: DiffRequest) -> ReviewResponse:
         )
 
 
+async def _run_pr_review(request: PRReviewRequest) -> ReviewResponse:
+    """Fetch, parse and review a PR diff."""
+    # Fetch the PR diff from GitHub (errors handled by exception handler)
+    diff_text = await fetch_pr_diff(
+        repo_owner=request.repo_owner,
+        repo_name=request.repo_name,
+        pr_number=request.pr_number,
+        github_token=request.github_token
+    )
+    
+    # Parse the diff
+    structured_diff = parse_unified_diff_to_dict(diff_text)
+    
+    # Check if parsing yielded any files
+    if not structured_diff["files"]:
+        raise EmptyPRError(
+            f"Pull request #{request.pr_number} has no parseable file changes",
+            details="Diff was fetched but contained no valid unified diff format"
+        )
+    
+    review_output = await run_review_pipeline_async(structured_diff)
+
+    # Return validated Pydantic response
+    return _build_review_response(review_output)
+
+
 @app.post("/review/pr", response_model=ReviewResponse)
 async def review_pr(request: PRReviewRequest) -> ReviewResponse:
     """Review a GitHub Pull Request by fetching its diff."""
@@ -191,40 +238,10 @@ async def review_pr(request: PRReviewRequest) -> ReviewResponse:
     )
     
     try:
-        # Fetch the PR diff from GitHub (errors handled by exception handler)
-        diff_text = await fetch_pr_diff(
-            repo_owner=request.repo_owner,
-            repo_name=request.repo_name,
-            pr_number=request.pr_number,
-            github_token=request.github_token
-        )
-        
-        # Parse the diff
-        parsed = parse_unified_diff(diff_text)
-        
-        # Check if parsing yielded any files
-        if not parsed:
-            raise EmptyPRError(
-                f"Pull request #{request.pr_number} has no parseable file changes",
-                details="Diff was fetched but contained no valid unified diff format"
-            )
-        
-        files = [
-            {
-                "file": fd.file,
-                "changes": [
-                    {"type": c.type, "line": c.line, "content": c.content}
-                    for c in fd.changes
-                ],
-            }
-            for fd in parsed
-        ]
-
-        structured_diff = {"files": files}
-        review_output = run_review_pipeline(structured_diff)
-
-        # Return validated Pydantic response
-        response = ReviewResponse(**review_output)
+        # Concurrent reviews of the same PR (with the same token) share one run
+        token_hash = hashlib.sha256(request.github_token.encode()).hexdigest()[:16]
+        key = f"{request.repo_owner}/{request.repo_name}#{request.pr_number}:{token_hash}"
+        response = await _pr_reviews.do(key, lambda: _run_pr_review(request))
         
         log_with_context(
             logger, "info", "PR review completed successfully",
@@ -1,11 +1,45 @@
 """GitHub API integration for fetching PR diffs."""
 
 import httpx
-from typing import Optional
+from cachetools import TTLCache
+from typing import Optional, Tuple
+from src.utils.diff_parser import has_binary_markers
 from src.utils.logger import setup_logger, log_with_context
 
 logger = setup_logger(__name__)
 
+# Total diff characters kept in the ETag cache; larger diffs are not cached
+_ETAG_CACHE_MAX_CHARS = 32 * 1024 * 1024
+
+# Last diff seen per PR, revalidated with If-None-Match: (owner, repo, pr) -> (etag, diff).
+# Bounded by total diff size rather than entry count, since one diff can be several MB
+_etag_cache: "TTLCache[Tuple[str, str, int], Tuple[str, str]]" = TTLCache(
+    maxsize=_ETAG_CACHE_MAX_CHARS, ttl=60 * 60, getsizeof=lambda entry: len(entry[1]) or 1
+)
+
+# Shared across requests so connections (and their TLS sessions) are reused
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """Return the process-wide GitHub client, creating it on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            http2=True,
+            timeout=httpx.Timeout(30.0),
+            limits=httpx.Limits(max_keepalive_connections=20),
+        )
+    return _client
+
+
+async def close_client() -> None:
+    """Close the shared GitHub client (called on app shutdown)."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
 
 class GitHubAPIError(Exception):
     """Base exception for GitHub API errors."""
@@ -69,6 +103,12 @@ async def fetch_pr_diff(
         "X-GitHub-Api-Version": "2022-11-28"
     }
     
+    cache_key = (repo_owner, repo_name, pr_number)
+    cached = _etag_cache.get(cache_key)
+    if cached is not None:
+        # GitHub answers 304 without resending the diff if it is unchanged
+        headers["If-None-Match"] = cached[0]
+    
     log_with_context(
         logger, "info", "Fetching PR diff from GitHub",
         repo=f"{repo_owner}/{repo_name}",
@@ -76,95 +116,111 @@ async def fetch_pr_diff(
         url=url
     )
     
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(url, headers=headers, timeout=30.0)
-            response.raise_for_status()
-            
-            diff_text = response.text
-            diff_size = len(diff_text)
-            
+    client = get_client()
+    try:
+        response = await client.get(url, headers=headers)
+        
+        # Checked before raise_for_status, which treats 304 as an error
+        if response.status_code == 304 and cached is not None:
             log_with_context(
-                logger, "info", "Successfully fetched PR diff",
+                logger, "info", "PR diff unchanged, using cached copy",
                 repo=f"{repo_owner}/{repo_name}",
-                pr_number=pr_number,
-                status_code=response.status_code,
-                diff_size_bytes=diff_size
+                pr_number=pr_number
             )
-            
-            # Check for empty PR
-            if not diff_text or diff_text.strip() == "":
-                log_with_context(
-                    logger, "warning", "Empty PR detected",
-                    repo=f"{repo_owner}/{repo_name}",
-                    pr_number=pr_number
-                )
-                raise EmptyPRError(
-                    f"Pull request #{pr_number} has no file changes",
-                    details=f"GET {url} returned empty diff"
-                )
-            
-            # Check for binary files indicator
-            if "Binary files" in diff_text or "GIT binary patch" in diff_text:
-                log_with_context(
-                    logger, "warning", "Binary files detected in PR",
-                    repo=f"{repo_owner}/{repo_name}",
-                    pr_number=pr_number
-                )
-                raise BinaryDiffError(
-                    "Pull request contains binary files that cannot be reviewed as text",
-                    details="Detected binary file markers in diff output"
-                )
-            
-            return diff_text
-            
-        except httpx.HTTPStatusError as e:
-            details = f"GET {url} returned {e.response.status_code}"
-            
+            # Re-insert to restart the TTL; the diff was just revalidated
+            _etag_cache[cache_key] = cached
+            return cached[1]
+        
+        response.raise_for_status()
+        
+        diff_text = response.text
+        diff_size = len(diff_text)
+        
+        log_with_context(
+            logger, "info", "Successfully fetched PR diff",
+            repo=f"{repo_owner}/{repo_name}",
+            pr_number=pr_number,
+            status_code=response.status_code,
+            diff_size_bytes=diff_size
+        )
+        
+        # Check for empty PR
+        if not diff_text or diff_text.strip() == "":
             log_with_context(
-                logger, "error", "GitHub API request failed",
+                logger, "warning", "Empty PR detected",
                 repo=f"{repo_owner}/{repo_name}",
-                pr_number=pr_number,
-                status_code=e.response.status_code,
-                error=str(e)
+                pr_number=pr_number
             )
-            
-            if e.response.status_code == 404:
-                raise PRNotFoundError(
-                    f"Pull request not found: {repo_owner}/{repo_name}#{pr_number}",
-                    details=f"{details}. Repository or PR may not exist, or you lack access."
-                )
-            elif e.response.status_code == 401:
-                raise InvalidTokenError(
-                    "Invalid or expired GitHub token",
-                    details=f"{details}. Check your personal access token."
+            raise EmptyPRError(
+                f"Pull request #{pr_number} has no file changes",
+                details=f"GET {url} returned empty diff"
+            )
+        
+        # Check for binary files indicator
+        if has_binary_markers(diff_text):
+            log_with_context(
+                logger, "warning", "Binary files detected in PR",
+                repo=f"{repo_owner}/{repo_name}",
+                pr_number=pr_number
+            )
+            raise BinaryDiffError(
+                "Pull request contains binary files that cannot be reviewed as text",
+                details="Detected binary file markers in diff output"
+            )
+        
+        etag = response.headers.get("ETag")
+        if etag and len(diff_text) <= _ETAG_CACHE_MAX_CHARS:
+            _etag_cache[cache_key] = (etag, diff_text)
+        
+        return diff_text
+        
+    except httpx.HTTPStatusError as e:
+        details = f"GET {url} returned {e.response.status_code}"
+        
+        log_with_context(
+            logger, "error", "GitHub API request failed",
+            repo=f"{repo_owner}/{repo_name}",
+            pr_number=pr_number,
+            status_code=e.response.status_code,
+            error=str(e)
+        )
+        
+        if e.response.status_code == 404:
+            raise PRNotFoundError(
+                f"Pull request not found: {repo_owner}/{repo_name}#{pr_number}",
+                details=f"{details}. Repository or PR may not exist, or you lack access."
+            )
+        elif e.response.status_code == 401:
+            raise InvalidTokenError(
+                "Invalid or expired GitHub token",
+                details=f"{details}. Check your personal access token."
+            )
+        elif e.response.status_code == 403:
+            # Check if it's rate limiting
+            if "rate limit" in e.response.text.lower():
+                raise RateLimitError(
+                    "GitHub API rate limit exceeded",
+                    details=f"{details}. Wait before making more requests or use authenticated token."
                 )
-            elif e.response.status_code == 403:
-                # Check if it's rate limiting
-                if "rate limit" in e.response.text.lower():
-                    raise RateLimitError(
-                        "GitHub API rate limit exceeded",
-                        details=f"{details}. Wait before making more requests or use authenticated token."
-                    )
-                else:
-                    raise InvalidTokenError(
-                        "Access forbidden - insufficient token permissions",
-                        details=f"{details}. Token may need 'repo' or 'public_repo' scope."
-                    )
             else:
-                raise GitHubAPIError(
-                    f"GitHub API request failed with status {e.response.status_code}",
-                    details=f"{details}: {e.response.text[:200]}"
+                raise InvalidTokenError(
+                    "Access forbidden - insufficient token permissions",
+                    details=f"{details}. Token may need 'repo' or 'public_repo' scope."
                 )
-                
-        except httpx.TimeoutException:
-            raise NetworkError(
-                "Request to GitHub API timed out",
-                details=f"Timeout after 30 seconds connecting to {url}"
+        else:
+            raise GitHubAPIError(
+                f"GitHub API request failed with status {e.response.status_code}",
+                details=f"{details}: {e.response.text[:200]}"
             )
             
-        except httpx.RequestError as e:
-            raise NetworkError(
-                "Failed to connect to GitHub API",
-                details=f"Network error: {str(e)}"
-            )
+    except httpx.TimeoutException:
+        raise NetworkError(
+            "Request to GitHub API timed out",
+            details=f"Timeout after 30 seconds connecting to {url}"
+        )
+        
+    except httpx.RequestError as e:
+        raise NetworkError(
+            "Failed to connect to GitHub API",
+            details=f"Network error: {str(e)}"
+        )
@@ -0,0 +1,153 @@
+"""Response cache for LLM review calls."""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Protocol, Tuple
+
+from src.utils.logger import setup_logger, log_with_context
+
+logger = setup_logger(__name__)
+
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+
+
+class CacheBackend(Protocol):
+    """Storage backend used by LLMCache."""
+
+    async def get(self, key: str) -> Optional[str]:
+        ...
+
+    async def set(self, key: str, value: str, ttl: Optional[int] = None) -> None:
+        ...
+
+
+class InMemoryLRUBackend:
+    """Process-local LRU cache with per-entry expiry."""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[Optional[float], str]]" = OrderedDict()
+        # May be shared by several event loops (see run_review_pipeline)
+        self._lock = threading.Lock()
+
+    async def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    async def set(self, key: str, value: str, ttl: Optional[int] = None) -> None:
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisBackend:
+    """Redis-backed cache shared across workers."""
+
+    def __init__(self, url: str, prefix: str = "llm-cache:"):
+        self.url = url
+        self.prefix = prefix
+        self._client = None
+        self._client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _get_client(self):
+        """One pooled client per event loop, created on first use."""
+        from redis.asyncio import Redis
+
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            # redis.asyncio connections are bound to the loop that opened them;
+            # only the sync run_review_pipeline wrapper runs on another loop
+            self._client = Redis.from_url(self.url, decode_responses=True)
+            self._client_loop = loop
+        return self._client
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self._get_client().get(self.prefix + key)
+
+    async def set(self, key: str, value: str, ttl: Optional[int] = None) -> None:
+        await self._get_client().set(self.prefix + key, value, ex=ttl)
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._client_loop = None
+
+
+class LLMCache:
+    """Cache of raw LLM outputs keyed by agent role, model and prompt."""
+
+    def __init__(self, backend: CacheBackend, default_ttl: Optional[int] = DEFAULT_TTL_SECONDS):
+        self.backend = backend
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(role: str, model: str, prompt: str) -> str:
+        payload = json.dumps({"role": role, "model": model, "prompt": prompt}, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    async def get(self, key: str) -> Optional[str]:
+        try:
+            value = await self.backend.get(key)
+        except Exception as e:
+            # A broken cache must never fail a review
+            log_with_context(logger, "warning", "LLM cache lookup failed", error=str(e))
+            value = None
+
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: str, value: str, ttl: Optional[int] = None) -> None:
+        try:
+            await self.backend.set(key, value, ttl if ttl is not None else self.default_ttl)
+        except Exception as e:
+            log_with_context(logger, "warning", "LLM cache write failed", error=str(e))
+
+    async def close(self) -> None:
+        """Release backend connections, if the backend holds any."""
+        close = getattr(self.backend, "close", None)
+        if close is not None:
+            await close()
+
+    def stats(self) -> Dict[str, int]:
+        return {"cache_hits": self.hits, "cache_misses": self.misses}
+
+
+def _build_default_cache() -> LLMCache:
+    """Use Redis when REDIS_URL is configured, otherwise an in-process LRU."""
+    ttl = int(os.getenv("LLM_CACHE_TTL", str(DEFAULT_TTL_SECONDS)))
+    redis_url = os.getenv("REDIS_URL")
+    if redis_url:
+        return LLMCache(RedisBackend(redis_url), default_ttl=ttl)
+    max_entries = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024"))
+    return LLMCache(InMemoryLRUBackend(max_entries=max_entries), default_ttl=ttl)
+
+
+llm_cache = _build_default_cache()
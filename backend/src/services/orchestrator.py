@@ -1,23 +1,80 @@
 from __future__ import annotations
 
 import asyncio
+import os
+import re
+import threading
 from concurrent.futures import ThreadPoolExecutor
-from typing import Any, Dict, List
+from time import monotonic
+from typing import Any, Callable, Dict, List, Tuple
 
+import orjson
+import tiktoken
 from crewai import Crew, Process, Task
+from pydantic import TypeAdapter
 
 from src.agents.agents import (
+    MODEL_ID,
+    consolidation_agent,
     logic_agent,
+    multi_reviewer_agent,
     performance_agent,
     readability_agent,
     security_agent,
 )
+from src.models.review import ReviewComment
+from src.services.llm_cache import LLMCache, llm_cache
+from src.services.rate_limiter import LIMITER, llm_retry
+from src.utils.diff_parser import format_diff_context
+from src.utils.json_extract import loads_llm_json
 from src.utils.logger import setup_logger, log_with_context
 
 logger = setup_logger(__name__)
 
-# Task descriptions for each review agent
-READABILITY_DESC = (
+# Send one combined prompt instead of four per-aspect prompts
+USE_MARSHALED_PROMPT = os.getenv("USE_MARSHALED_PROMPT", "false").lower() == "true"
+
+# Let consolidation_agent rewrite the merged findings (one extra LLM call)
+USE_LLM_CONSOLIDATION = os.getenv("USE_LLM_CONSOLIDATION", "false").lower() == "true"
+
+REVIEW_SOURCES = ("readability", "logic", "performance", "security")
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# Findings must pass this before their raw output is cached or returned
+_findings_adapter = TypeAdapter(List[ReviewComment])
+
+# Large diffs are split into chunks of at most this many prompt tokens
+MAX_CHUNK_TOKENS = int(os.getenv("MAX_CHUNK_TOKENS", "3000"))
+MAX_AGENT_CONCURRENCY = int(os.getenv("MAX_AGENT_CONCURRENCY", "16"))
+
+REVIEW_POOL_SIZE = int(os.getenv("REVIEW_POOL_SIZE", "16"))
+
+# Process-wide pool for the blocking crew.kickoff() calls, shared by all requests.
+# Created lazily so a later app lifespan gets a fresh pool after shutdown_agent_pool()
+_pool: ThreadPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    """Return the agent pool, creating it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=REVIEW_POOL_SIZE, thread_name_prefix="review-agent")
+        return _pool
+
+
+def _split_prompt(template: str) -> Tuple[str, str]:
+    """Pre-split a prompt at its {diff_context} placeholder into (prefix, suffix)."""
+    prefix, placeholder, suffix = template.partition("{diff_context}")
+    if not placeholder:
+        raise ValueError("Prompt template has no {diff_context} placeholder")
+    return prefix, suffix
+
+
+# Task descriptions for each review agent, as (prefix, suffix) around the diff
+READABILITY_DESC = _split_prompt(
     "Review this code for readability issues:\n\n{diff_context}\n\n"
     "Analyze ONLY the lines marked with (+) for: poor variable/function naming, "
     "missing comments, inconsistent formatting, unclear logic flow. "
@@ -27,7 +84,7 @@ READABILITY_DESC = (
     "Return ONLY a JSON array of findings, nothing else."
 )
 
-LOGIC_DESC = (
+LOGIC_DESC = _split_prompt(
     "Review this code for logic errors and bugs:\n\n{diff_context}\n\n"
     "Analyze ONLY the lines marked with (+) for: incorrect conditions, missing null/undefined checks, "
     "off-by-one errors, incorrect return values, missing error handling, unreachable code. "
@@ -37,7 +94,7 @@ LOGIC_DESC = (
     "Return ONLY a JSON array of findings, nothing else."
 )
 
-PERFORMANCE_DESC = (
+PERFORMANCE_DESC = _split_prompt(
     "Review this code for performance issues:\n\n{diff_context}\n\n"
     "Analyze ONLY the lines marked with (+) for: nested loops with O(n²) or worse complexity, "
     "redundant operations inside loops, unnecessary memory allocations, inefficient algorithms, "
@@ -48,7 +105,7 @@ PERFORMANCE_DESC = (
     "Return ONLY a JSON array of findings, nothing else."
 )
 
-SECURITY_DESC = (
+SECURITY_DESC = _split_prompt(
     "Review this code for security vulnerabilities:\n\n{diff_context}\n\n"
     "Analyze ONLY the lines marked with (+) for: SQL/command injection risks, XSS vulnerabilities, "
     "hardcoded secrets/credentials, insecure APIs, missing input validation, unsafe deserialization, "
@@ -59,116 +116,330 @@ SECURITY_DESC = (
     "Return ONLY a JSON array of findings, nothing else."
 )
 
+COMBINED_DESC = _split_prompt(
+    "Review this code for readability, logic, performance, and security issues:\n\n{diff_context}\n\n"
+    "Analyze ONLY the lines marked with (+). Cover each aspect separately:\n"
+    "- readability: poor variable/function naming, missing comments, inconsistent formatting, "
+    "unclear logic flow.\n"
+    "- logic: incorrect conditions, missing null/undefined checks, off-by-one errors, "
+    "incorrect return values, missing error handling, unreachable code.\n"
+    "- performance: nested loops with O(n²) or worse complexity, redundant operations inside loops, "
+    "unnecessary memory allocations, inefficient algorithms, repeated expensive operations that "
+    "should be cached, N+1 query patterns.\n"
+    "- security: SQL/command injection risks, XSS vulnerabilities, hardcoded secrets/credentials, "
+    "insecure APIs, missing input validation, unsafe deserialization, path traversal, SSRF, "
+    "insecure random number generation.\n"
+    "For each issue found, return a JSON object with: file (string), line (number), "
+    "severity (one of: critical, error, warning, high, moderate, medium, low, info), "
+    "issue (brief description), recommendation (how to fix), source (the aspect name). "
+    "Return ONLY a JSON object with exactly four keys, readability, logic, performance and security, "
+    "each holding a JSON array of findings (empty if none), nothing else."
+)
 
-def _run_single_agent_task(agent, task_description: str, diff_context: str, agent_name: str) -> str:
-    """Run a single agent task and return the result."""
-    import json
-    
-    logger.info(f"Running {agent_name}")
+CONSOLIDATION_DESC = _split_prompt(
+    "Merge these code review findings from several reviewers:\n\n{diff_context}\n\n"
+    "Combine findings that describe the same problem on the same file and line, keeping the "
+    "most severe severity and the clearest issue and recommendation text. Do not invent new findings. "
+    "Keep the fields: file (string), line (number), severity (one of: critical, error, warning, "
+    "high, moderate, medium, low, info), issue, recommendation, source. "
+    "Return ONLY a JSON array of findings, nothing else."
+)
+
+
+def build_review_crew(agent, prompt: str, expected_output: str) -> Crew:
+    """Build a single-agent, single-task crew for one review prompt.
     
-    # Create a minimal crew with just one agent and task
+    Crew, Task and the agent's executor all hold per-run state, so a fresh
+    crew is wired per call around a copy of the module-level agent.
+    """
+    agent = agent.copy()
     task = Task(
-        description=task_description.format(diff_context=diff_context),
+        description=prompt,
         agent=agent,
-        expected_output=f"A JSON array of {agent_name.lower()} findings.",
+        expected_output=expected_output,
     )
-    
-    crew = Crew(
+    return Crew(
         agents=[agent],
         tasks=[task],
         process=Process.sequential,
         verbose=False,
     )
+
+
+@llm_retry
+async def _kickoff_with_limits(crew: Crew) -> str:
+    """Kick off a crew within the shared LLM rate limit, retrying on 429s."""
+    async with LIMITER:
+        # Like crew.kickoff_async(), but on the bounded agent pool
+        loop = asyncio.get_running_loop()
+        return str(await loop.run_in_executor(_get_pool(), crew.kickoff))
+
+
+async def _run_single_agent_task_async(
+    agent,
+    task_description: Tuple[str, str],
+    diff_context: str,
+    agent_name: str,
+    expected_output: str | None = None,
+    decode: Callable[[str], List[Dict[str, Any]]] | None = None,
+) -> List[Dict[str, Any]]:
+    """Run a single agent task and return its decoded, validated findings.
     
-    result = crew.kickoff()
-    return str(result)
+    Raw output is cached only once decode accepts it, so the answer is decoded
+    exactly once per call. Raises ValueError if it does not decode.
+    """
+    decode = decode or _decode_findings
+    prefix, suffix = task_description
+    prompt = prefix + diff_context + suffix
+    cache_key = LLMCache.make_key(agent.role, MODEL_ID, prompt)
+    cached = await llm_cache.get(cache_key)
+    if cached is not None:
+        log_with_context(
+            logger, "info", "LLM cache hit",
+            agent=agent_name,
+            **llm_cache.stats()
+        )
+        return decode(cached)
+    
+    crew = build_review_crew(
+        agent, prompt,
+        expected_output or f"A JSON array of {agent_name.lower()} findings.",
+    )
+    result = await _kickoff_with_limits(crew)
+    log_with_context(
+        logger, "info", "LLM cache miss",
+        agent=agent_name,
+        **llm_cache.stats()
+    )
+    try:
+        findings = decode(result)
+    except ValueError:
+        # A cached bad answer would be replayed on every retry until it expires
+        logger.warning("Not caching %s output that does not parse into valid findings", agent_name)
+        raise
+    await llm_cache.set(cache_key, result)
+    return findings
 
 
-def run_review_pipeline(structured_diff: Dict[str, Any]) -> Dict[str, Any]:
-    """Run the CrewAI review pipeline on a structured diff with parallel execution.
+async def _run_bounded(semaphore: asyncio.Semaphore, *args, **kwargs) -> List[Dict[str, Any]]:
+    """Run an agent task once a concurrency slot is free."""
+    async with semaphore:
+        return await _run_single_agent_task_async(*args, **kwargs)
+
+
+# Seconds to wait before retrying a failed tokenizer load
+_TOKENIZER_RETRY_SECONDS = 300.0
+_encoding = None
+_encoding_retry_at = 0.0
+
+
+def load_tokenizer():
+    """Load the tokenizer once; None while it is unavailable (e.g. offline).
+
+    Called from the app lifespan so the download happens off the request path.
+    A failed load is retried after _TOKENIZER_RETRY_SECONDS instead of sticking.
     """
-    import json
-    import re
-    from time import time
+    global _encoding, _encoding_retry_at
+    if _encoding is not None or monotonic() < _encoding_retry_at:
+        return _encoding
+    try:
+        _encoding = tiktoken.encoding_for_model("gpt-4o-mini")
+    except Exception as e:
+        _encoding_retry_at = monotonic() + _TOKENIZER_RETRY_SECONDS
+        log_with_context(logger, "warning", "Tokenizer unavailable, estimating token counts", error=str(e))
+    return _encoding
 
-    start_time = time()
-    logger.info("Starting review pipeline with parallel execution")
+
+def _count_tokens(text: str) -> int:
+    encoding = load_tokenizer()
+    if encoding is None:
+        # Roughly four characters per token for code
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def _chunk_diff(structured_diff: Dict[str, Any], max_tokens: int = MAX_CHUNK_TOKENS) -> List[Dict[str, Any]]:
+    """Split a structured diff into sub-diffs of at most max_tokens prompt tokens.
+    
+    Chunks follow file boundaries; a single file larger than max_tokens gets a chunk of its own.
+    """
+    chunks: List[Dict[str, Any]] = []
+    current: List[Dict[str, Any]] = []
+    current_tokens = 0
     
-    # Format the diff data as a readable string for the LLM
-    diff_context = "Code changes to review:\n\n"
     for file_data in structured_diff.get("files", []):
-        diff_context += f"File: {file_data['file']}\n"
-        diff_context += "Changes:\n"
-        for change in file_data.get("changes", []):
-            if change["type"] == "addition":
-                diff_context += f"  Line {change['line']} (+): {change['content']}\n"
-            elif change["type"] == "deletion":
-                diff_context += f"  Line {change['line']} (-): {change['content']}\n"
-        diff_context += "\n"
-
-    # Run 4 review agents in parallel using ThreadPoolExecutor
-    logger.info("Running 4 review agents in parallel")
-    with ThreadPoolExecutor(max_workers=4) as executor:
-        futures = {
-            executor.submit(_run_single_agent_task, readability_agent, READABILITY_DESC, diff_context, "ReadabilityAgent"): "readability",
-            executor.submit(_run_single_agent_task, logic_agent, LOGIC_DESC, diff_context, "LogicAgent"): "logic",
-            executor.submit(_run_single_agent_task, performance_agent, PERFORMANCE_DESC, diff_context, "PerformanceAgent"): "performance",
-            executor.submit(_run_single_agent_task, security_agent, SECURITY_DESC, diff_context, "SecurityAgent"): "security",
-        }
-        
-        # Collect results as they complete
-        agent_results = {}
-        for future in futures:
-            agent_type = futures[future]
-            try:
-                result = future.result()
-                agent_results[agent_type] = result
-                logger.info(f"{agent_type.capitalize()}Agent completed")
-            except Exception as e:
-                logger.error(f"{agent_type.capitalize()}Agent failed: {str(e)}")
-                agent_results[agent_type] = "[]"
-    
-    parallel_time = time() - start_time
-    logger.info(f"Parallel execution completed in {parallel_time:.2f}s")
-    
-    # Parse results from all agents
+        tokens = _count_tokens(format_diff_context([file_data]))
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append({"files": current})
+            current = []
+            current_tokens = 0
+        current.append(file_data)
+        current_tokens += tokens
+    
+    if current:
+        chunks.append({"files": current})
+    return chunks
+
+
+def _parse_agent_output(result_str: str) -> List[Any]:
+    """Decode an agent's raw output into its list of findings.
+    
+    Accepts a bare array, {"comments": [...]}, or the combined object with one
+    array per review aspect. Raises ValueError for anything else.
+    """
+    parsed = loads_llm_json(result_str)
+    if isinstance(parsed, dict) and "comments" in parsed:
+        parsed = parsed["comments"]
+    if isinstance(parsed, list):
+        return parsed
+    if not isinstance(parsed, dict):
+        raise ValueError("Agent output is not a findings array or object")
+    
+    # Combined output: skip aspects that are not arrays and items that are not objects
+    findings = []
+    for source in REVIEW_SOURCES:
+        values = parsed.get(source)
+        if not isinstance(values, list):
+            continue
+        for comment in values:
+            if isinstance(comment, dict):
+                comment.setdefault("source", source)
+                findings.append(comment)
+    return findings
+
+
+def _validate_findings(findings: List[Any]) -> List[Dict[str, Any]]:
+    """Validate findings in one pydantic-core call; return them as plain dicts.
+    
+    The dicts come from the validated models, so coerced values (e.g. a "3"
+    line) are what later stages see. Raises ValueError on any invalid finding.
+    """
+    return _findings_adapter.dump_python(_findings_adapter.validate_python(findings))
+
+
+def _decode_findings(result_str: str) -> List[Dict[str, Any]]:
+    """Decode a review agent's output into validated findings."""
+    findings = _parse_agent_output(result_str)
+    return _validate_findings([c for c in findings if isinstance(c, dict)])
+
+
+def _decode_consolidated(result_str: str) -> List[Dict[str, Any]]:
+    """Decode consolidation_agent's output; unlike review output it must hold a list."""
+    parsed = loads_llm_json(result_str)
+    if isinstance(parsed, dict):
+        parsed = parsed.get("comments")
+    if not isinstance(parsed, list):
+        raise ValueError("ConsolidationAgent returned no findings list")
+    return _validate_findings(parsed)
+
+
+def _comment_fingerprint(comment: Dict[str, Any]) -> int:
+    """64-bit fingerprint of a finding's file, line and canonicalized issue prefix."""
+    # Collapse whitespace and case so agents' near-identical wording collides
+    issue = _WHITESPACE_RE.sub(" ", str(comment.get("issue") or "")).strip().lower()[:80]
+    # str() keeps unhashable values from a malformed finding (e.g. "line": [1]) hashable
+    return hash((str(comment.get("file", "")), str(comment.get("line", 0)), issue))
+
+
+def _dedupe_comments(all_comments: List[Any]) -> List[Dict[str, Any]]:
+    """Drop findings that repeat the same file, line and issue, keeping the first."""
+    # setdefault keeps the first finding per fingerprint in one dict lookup
+    unique: Dict[int, Dict[str, Any]] = {}
+    for comment in all_comments:
+        if isinstance(comment, dict):
+            unique.setdefault(_comment_fingerprint(comment), comment)
+    return list(unique.values())
+
+
+async def _consolidate_with_llm(comments: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Ask consolidation_agent to merge findings; keep the input on any failure."""
+    findings = orjson.dumps(comments).decode()
+    try:
+        # One bad rewritten finding fails decoding, so it cannot fail the whole response
+        consolidated = await _run_single_agent_task_async(
+            consolidation_agent, CONSOLIDATION_DESC, findings, "ConsolidationAgent",
+            decode=_decode_consolidated,
+        )
+    except Exception as e:
+        logger.warning("ConsolidationAgent failed, keeping merged findings: %s", e)
+        return comments
+    return _dedupe_comments(consolidated)
+
+
+async def run_review_pipeline_async(structured_diff: Dict[str, Any]) -> Dict[str, Any]:
+    """Run the CrewAI review pipeline on a structured diff with concurrent agents.
+    """
+    start_time = monotonic()
+    logger.info("Starting review pipeline with parallel execution")
+    
+    # Agents only review added lines, so files without additions add nothing
+    files = [
+        file_data for file_data in structured_diff.get("files", [])
+        if any(c["type"] == "addition" for c in file_data.get("changes", []))
+    ]
+    if not files:
+        log_with_context(
+            logger, "info", "No added lines to review, skipping agents",
+            files_in_diff=len(structured_diff.get("files", []))
+        )
+        return {"comments": []}
+    
+    # Format each chunk of the diff as a readable string for the LLM
+    # Tokenizing large diffs is CPU-bound, keep it off the event loop
+    chunks = await asyncio.to_thread(_chunk_diff, {"files": files})
+    diff_contexts = [format_diff_context(chunk["files"]) for chunk in chunks]
+    
+    if USE_MARSHALED_PROMPT:
+        # One LLM call per chunk covering all four aspects
+        logger.info("Running combined review on %d chunk(s)", len(chunks))
+        jobs = [
+            ("combined", multi_reviewer_agent, COMBINED_DESC, "MultiReviewerAgent",
+             "A JSON object of findings keyed by review aspect.")
+        ]
+    else:
+        # Run 4 review agents per chunk concurrently on the event loop
+        logger.info("Running 4 review agents in parallel on %d chunk(s)", len(chunks))
+        jobs = [
+            ("readability", readability_agent, READABILITY_DESC, "ReadabilityAgent", None),
+            ("logic", logic_agent, LOGIC_DESC, "LogicAgent", None),
+            ("performance", performance_agent, PERFORMANCE_DESC, "PerformanceAgent", None),
+            ("security", security_agent, SECURITY_DESC, "SecurityAgent", None),
+        ]
+    
+    semaphore = asyncio.Semaphore(MAX_AGENT_CONCURRENCY)
+    job_sources = []
+    tasks = []
+    for diff_context in diff_contexts:
+        for source, agent, description, agent_name, expected_output in jobs:
+            job_sources.append((source, agent_name))
+            tasks.append(asyncio.create_task(_run_bounded(
+                semaphore, agent, description, diff_context, agent_name,
+                expected_output=expected_output,
+            )))
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    
+    # Each result is already decoded and validated; unparseable output yields no comments
     all_comments = []
-    for agent_type, result_str in agent_results.items():
-        json_match = re.search(r"```json\s*\n(.*?)\n```", result_str, re.DOTALL)
-        if json_match:
-            json_str = json_match.group(1)
+    for (agent_type, agent_name), result in zip(job_sources, results):
+        if isinstance(result, ValueError):
+            logger.warning("Failed to parse %s agent output into findings: %s", agent_type, result)
+        elif isinstance(result, Exception):
+            logger.error("%s failed: %s", agent_name, result)
         else:
-            json_str = result_str
-        
-        try:
-            parsed = json.loads(json_str)
-            if isinstance(parsed, list):
-                all_comments.extend(parsed)
-            elif isinstance(parsed, dict) and "comments" in parsed:
-                all_comments.extend(parsed["comments"])
-        except json.JSONDecodeError:
-            logger.warning(f"Failed to parse {agent_type} agent output as JSON")
+            all_comments.extend(result)
+            logger.info("%s completed", agent_name)
+    
+    parallel_time = monotonic() - start_time
+    logger.info("Parallel execution completed in %.2fs", parallel_time)
     
     # Deduplicate and merge results programmatically instead of using consolidation agent
     logger.info("Deduplicating and merging findings")
     
-    # Simple deduplication: remove duplicates based on file, line, and issue similarity
-    seen = set()
-    comments = []
-    
-    for comment in all_comments:
-        # Create a key for deduplication
-        key = (
-            comment.get("file", ""),
-            comment.get("line", 0),
-            comment.get("issue", "")[:50]  # First 50 chars of issue
-        )
-        
-        if key not in seen:
-            seen.add(key)
-            comments.append(comment)
+    comments = _dedupe_comments(all_comments)
+    if USE_LLM_CONSOLIDATION and comments:
+        comments = await _consolidate_with_llm(comments)
     
-    total_time = time() - start_time
+    total_time = monotonic() - start_time
     
     log_with_context(
         logger, "info", "Review pipeline completed",
@@ -182,3 +453,21 @@ def run_review_pipeline(structured_diff: Dict[str, Any]) -> Dict[str, Any]:
     )
     
     return {"comments": comments}
+
+
+def shutdown_agent_pool() -> None:
+    """Wait for in-flight agent calls and stop the pool threads.
+    
+    Blocks, so async callers should run it in a thread. The next kickoff
+    creates a new pool.
+    """
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True)
+
+
+def run_review_pipeline(structured_diff: Dict[str, Any]) -> Dict[str, Any]:
+    """Synchronous entry point for callers outside an event loop."""
+    return asyncio.run(run_review_pipeline_async(structured_diff))
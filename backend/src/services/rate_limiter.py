@@ -0,0 +1,108 @@
+"""Client-side rate limiting and retry policy for LLM calls.
+
+The limiter is acquired once per crew kickoff, not per LLM request: one
+kickoff can make several LLM calls (agent iterations and crewai's own
+max_retry_limit retries), so LLM_RPM caps kickoffs per minute.
+"""
+
+import asyncio
+import os
+import time
+from typing import Optional
+
+from openai import RateLimitError
+from tenacity import (
+    RetryCallState,
+    retry,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_exponential_jitter,
+)
+
+from src.utils.logger import setup_logger, log_with_context
+
+logger = setup_logger(__name__)
+
+# Crew kickoffs per minute; each may issue more than one LLM request
+LLM_RPM = int(os.getenv("LLM_RPM", "500"))
+MAX_RETRY_WAIT_SECONDS = 30.0
+
+
+class AsyncLimiter:
+    """Leaky-bucket limiter allowing max_rate acquisitions per time_period seconds.
+
+    Holds no loop-bound primitives, so one instance can be shared by every
+    event loop in the process.
+    """
+
+    def __init__(self, max_rate: float, time_period: float = 60.0):
+        self.max_rate = max_rate
+        self.time_period = time_period
+        self._leak_interval = time_period / max_rate
+        self._level = 0.0
+        self._last_check = time.monotonic()
+
+    def _leak(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._last_check
+        self._level = max(0.0, self._level - elapsed / self._leak_interval)
+        self._last_check = now
+
+    async def acquire(self) -> None:
+        while True:
+            self._leak()
+            if self._level + 1 <= self.max_rate:
+                self._level += 1
+                return
+            await asyncio.sleep((self._level + 1 - self.max_rate) * self._leak_interval)
+
+    async def __aenter__(self) -> "AsyncLimiter":
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        return None
+
+
+LIMITER = AsyncLimiter(max_rate=LLM_RPM, time_period=60)
+
+
+def retry_after_seconds(exc: Optional[BaseException]) -> Optional[float]:
+    """Read the Retry-After header from a provider rate-limit error, if any."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after")
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+_backoff = wait_exponential_jitter(initial=1, max=MAX_RETRY_WAIT_SECONDS)
+
+
+def wait_retry_after(retry_state: RetryCallState) -> float:
+    """Honor Retry-After when the provider sends it, otherwise back off exponentially."""
+    exc = retry_state.outcome.exception() if retry_state.outcome else None
+    delay = retry_after_seconds(exc)
+    if delay is None:
+        delay = _backoff(retry_state)
+    delay = min(delay, MAX_RETRY_WAIT_SECONDS)
+
+    log_with_context(
+        logger, "warning", "LLM rate limited, retrying",
+        attempt=retry_state.attempt_number,
+        wait_seconds=round(delay, 2)
+    )
+    return delay
+
+
+# Retries provider 429s (litellm's RateLimitError subclasses openai's)
+llm_retry = retry(
+    retry=retry_if_exception_type(RateLimitError),
+    wait=wait_retry_after,
+    stop=stop_after_attempt(5),
+    reraise=True,
+)
@@ -1,53 +1,148 @@
 from __future__ import annotations
 
+import re
+import sys
 from dataclasses import dataclass
-from typing import List, Literal, Optional
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Literal, Optional, Tuple
 from src.utils.logger import setup_logger, log_with_context
 
 logger = setup_logger(__name__)
 
 ChangeType = Literal["addition", "deletion", "context"]
 
+_ADD = sys.intern("addition")
+_DEL = sys.intern("deletion")
+_CTX = sys.intern("context")
 
-@dataclass
+# Context lines are not shown to the reviewers
+_CHANGE_SYMBOLS = {"addition": "+", "deletion": "-"}
+
+# Git writes these at the start of a line for files it cannot show as text
+_BINARY_MARKERS = ("Binary files ", "GIT binary patch")
+
+# Hunk header: @@ -old_start[,old_count] +new_start[,new_count] @@
+_HUNK_RE = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)(?:,\d+)? @@")
+
+# First characters of lines inside a hunk body
+_BODY_PREFIXES = ("+", "-", " ", "\t")
+
+# Lines the parser acts on outside a hunk body
+_HEADER_PREFIXES = ("diff --git ", "+++ ", "@@ ")
+
+
+@dataclass(slots=True)
 class LineChange:
     type: ChangeType
     line: Optional[int]
     content: str
 
 
-@dataclass
+@dataclass(slots=True)
 class FileDiff:
     file: str
     changes: List[LineChange]
 
 
+def has_binary_markers(diff_text: str) -> bool:
+    """Check whether a diff contains git binary-file markers.
+    
+    Markers only count at the start of a line, so added code that mentions
+    them is not mistaken for a binary file. Uses plain substring search,
+    which is faster than a single-pass regex over large diffs.
+    """
+    return any(
+        diff_text.startswith(marker) or ("\n" + marker) in diff_text
+        for marker in _BINARY_MARKERS
+    )
+
+
 def parse_unified_diff(diff_text: str) -> List[FileDiff]:
     """Parse a unified diff string into a list of FileDiff objects.
     """
+    return list(iter_unified_diff(diff_text))
+
+
+def iter_unified_diff(diff_text: str) -> Iterator[FileDiff]:
+    """Parse a unified diff string, yielding each FileDiff as soon as it is complete.
+    """
+    for file_path, changes in _iter_file_changes(diff_text, LineChange):
+        yield FileDiff(file=file_path, changes=changes)
+
+
+def parse_unified_diff_to_dict(diff_text: str) -> Dict[str, Any]:
+    """Parse a unified diff straight into the pipeline's {"files": [...]} payload.
+    
+    Builds the change dicts in the parse loop, skipping the LineChange objects.
+    """
+    return {
+        "files": [
+            {"file": file_path, "changes": changes}
+            for file_path, changes in _iter_file_changes(diff_text, _change_dict)
+        ]
+    }
+
+
+def _change_dict(type: ChangeType, line: Optional[int], content: str) -> Dict[str, Any]:
+    return {"type": type, "line": line, "content": content}
+
+
+def _iter_file_changes(
+    diff_text: str, make_change: Callable[..., Any]
+) -> Iterator[Tuple[str, List[Any]]]:
+    """Yield (file_path, changes) per file, building each change with make_change."""
     logger.info("Starting diff parsing")
     
-    lines = diff_text.splitlines()
-    file_diffs: List[FileDiff] = []
+    total_files = 0
+    total_additions = 0
+    total_deletions = 0
+    total_context = 0
 
-    current_file: Optional[FileDiff] = None
+    current_file: Optional[str] = None
+    changes: List[Any] = []
     new_line_no: Optional[int] = None
 
-    i = 0
-    while i < len(lines):
-        line = lines[i]
+    for line in diff_text.splitlines():
+        first = line[:1]
+
+        # Inside a hunk: track additions, deletions, context. Checked first
+        # since body lines make up nearly all of a diff; "+++ " is a header.
+        if (
+            first in _BODY_PREFIXES
+            and new_line_no is not None
+            and current_file is not None
+            and not (first == "+" and line.startswith("+++ "))
+        ):
+            content = line[1:]
+
+            if first == "+":
+                changes.append(make_change(_ADD, new_line_no, content))
+                new_line_no += 1
+                total_additions += 1
+            elif first == "-":
+                changes.append(make_change(_DEL, None, content))
+                # deletions do not advance new_line_no
+                total_deletions += 1
+            else:
+                changes.append(make_change(_CTX, new_line_no, content))
+                new_line_no += 1
+                total_context += 1
+            continue
+
+        # Skip index/mode/--- and other metadata lines with one C-level check
+        if not line.startswith(_HEADER_PREFIXES):
+            continue
 
         # Start of a new file diff (Git style)
-        if line.startswith("diff --git "):
+        if first == "d" and line.startswith("diff --git "):
             if current_file is not None:
-                file_diffs.append(current_file)
+                total_files += 1
+                yield current_file, changes
             current_file = None
             new_line_no = None
-            i += 1
             continue
 
         # File path from +++ line (use new file path)
-        if line.startswith("+++ "):
+        if first == "+" and line.startswith("+++ "):
             # format: +++ b/path/to/file or +++ /dev/null
             path_part = line[4:].strip()
             if path_part == "/dev/null":
@@ -59,67 +154,37 @@ def parse_unified_diff(diff_text: str) -> List[FileDiff]:
                 else:
                     file_path = path_part
 
-            current_file = FileDiff(file=file_path, changes=[])
-            i += 1
+            current_file = file_path
+            changes = []
             continue
 
         # Hunk header: @@ -old_start,old_count +new_start,new_count @@
-        if line.startswith("@@ ") and current_file is not None:
-            try:
-                header = line.split("@@")[1].strip()
-                # header like: -1,3 +1,4 or -10 +12
-                parts = header.split()
-                new_part = [p for p in parts if p.startswith("+")][0]
-                # remove leading '+' and possible ',count'
-                new_start_str = new_part[1:].split(",")[0]
-                new_line_no = int(new_start_str)
-            except Exception:
-                new_line_no = None
-            i += 1
-            continue
-
-        # Inside a hunk: track additions, deletions, context
-        if current_file is not None and new_line_no is not None and line:
-            prefix = line[0]
-            content = line[1:]
-
-            if prefix == "+":
-                current_file.changes.append(
-                    LineChange(type="addition", line=new_line_no, content=content)
-                )
-                new_line_no += 1
-            elif prefix == "-":
-                current_file.changes.append(
-                    LineChange(type="deletion", line=None, content=content)
-                )
-                # deletions do not advance new_line_no
-            elif prefix == " " or prefix == "\t":
-                current_file.changes.append(
-                    LineChange(type="context", line=new_line_no, content=content)
-                )
-                new_line_no += 1
-
-        i += 1
+        if first == "@" and line.startswith("@@ ") and current_file is not None:
+            m = _HUNK_RE.match(line)
+            new_line_no = int(m.group(1)) if m else None
 
     if current_file is not None:
-        file_diffs.append(current_file)
-
-    # Calculate statistics
-    total_files = len(file_diffs)
-    total_additions = sum(
-        len([c for c in fd.changes if c.type == "addition"]) for fd in file_diffs
-    )
-    total_deletions = sum(
-        len([c for c in fd.changes if c.type == "deletion"]) for fd in file_diffs
-    )
-    total_changes = sum(len(fd.changes) for fd in file_diffs)
+        total_files += 1
+        yield current_file, changes
     
     log_with_context(
         logger, "info", "Diff parsing completed",
         files_parsed=total_files,
-        total_changes=total_changes,
+        total_changes=total_additions + total_deletions + total_context,
         additions=total_additions,
         deletions=total_deletions
     )
 
-    return file_diffs
+
+def format_diff_context(files: Iterable[Dict[str, Any]]) -> str:
+    """Render structured diff files as the prompt text given to review agents.
+    """
+    parts = ["Code changes to review:\n\n"]
+    for file_data in files:
+        parts.append(f"File: {file_data['file']}\nChanges:\n")
+        for change in file_data.get("changes", []):
+            symbol = _CHANGE_SYMBOLS.get(change["type"])
+            if symbol is not None:
+                parts.append(f"  Line {change['line']} ({symbol}): {change['content']}\n")
+        parts.append("\n")
+    return "".join(parts)
@@ -0,0 +1,44 @@
+"""Extract and decode JSON payloads from LLM output."""
+
+from typing import Any
+
+import orjson
+
+_FENCE_OPEN = "```json"
+# The closing fence starts a line; JSON strings cannot hold a raw newline,
+# so backticks quoted inside a finding never match
+_FENCE_CLOSE = "\n```"
+
+
+def extract_json(text: str) -> str:
+    """Return the JSON portion of an LLM response.
+
+    Prefers a ```json fenced block closed by ``` at the start of a line;
+    otherwise takes the span from the first
+    '[' or '{' to the last matching closer. Uses forward/backward scans only.
+    """
+    start = text.find(_FENCE_OPEN)
+    if start != -1:
+        body_start = start + len(_FENCE_OPEN)
+        end = text.find(_FENCE_CLOSE, body_start)
+        if end != -1:
+            return text[body_start:end].strip()
+
+    # No fence: fall back to the outermost array or object
+    openers = [i for i in (text.find("["), text.find("{")) if i != -1]
+    if not openers:
+        return text.strip()
+
+    start = min(openers)
+    end = text.rfind("]" if text[start] == "[" else "}")
+    if end > start:
+        return text[start:end + 1]
+    return text.strip()
+
+
+def loads_llm_json(text: str) -> Any:
+    """Decode the JSON payload of an LLM response.
+
+    Raises orjson.JSONDecodeError (a json.JSONDecodeError) if it is not valid JSON.
+    """
+    return orjson.loads(extract_json(text).encode())
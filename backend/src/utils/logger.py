@@ -2,17 +2,20 @@
 
 import logging
 import sys
-import json
 from datetime import datetime, timezone
 from typing import Any, Dict
 
+import orjson
+
 
 class JSONFormatter(logging.Formatter):
     """Format log records as JSON."""
     
     def format(self, record: logging.LogRecord) -> str:
         log_data: Dict[str, Any] = {
-            "timestamp": datetime.now(timezone.utc).isoformat(),
+            # record.created is already taken when the record is made; orjson
+            # writes the datetime in the same ISO 8601 form as isoformat()
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc),
             "level": record.levelname,
             "logger": record.name,
             "message": record.getMessage(),
@@ -26,7 +29,7 @@ class JSONFormatter(logging.Formatter):
         if record.exc_info:
             log_data["exception"] = self.formatException(record.exc_info)
         
-        return json.dumps(log_data)
+        return orjson.dumps(log_data, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
 
 
 def setup_logger(name: str, level: str = "INFO") -> logging.Logger:
@@ -53,8 +56,12 @@ def log_with_context(logger: logging.Logger, level: str, message: str, **kwargs)
     """
     Log a message with additional context fields.
     """
-    log_func = getattr(logger, level.lower())
+    level_no = getattr(logging, level.upper())
+    
+    # Skip building the record when the level is filtered out
+    if not logger.isEnabledFor(level_no):
+        return
     
     # Create a log record with extra fields
     extra = {"extra_fields": kwargs}
-    log_func(message, extra=extra)
+    logger.log(level_no, message, extra=extra)
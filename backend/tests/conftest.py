@@ -11,3 +11,9 @@ sys.path.insert(0, str(project_root))
 
 # Set environment variable for testing
 os.environ["OPENROUTER_API_KEY"] = "test-key-for-unit-tests"
+
+
+def pytest_configure(config):
+    """FAST_TESTS=1 skips tests marked slow, unless -m was given explicitly."""
+    if os.getenv("FAST_TESTS") == "1" and not config.option.markexpr:
+        config.option.markexpr = "not slow"
@@ -1,7 +1,12 @@
 """Unit tests for diff parser."""
 
 import pytest
-from src.utils.diff_parser import parse_unified_diff
+from src.utils.diff_parser import (
+    format_diff_context,
+    has_binary_markers,
+    parse_unified_diff,
+    parse_unified_diff_to_dict,
+)
 
 
 def test_parse_single_file_addition():
@@ -107,3 +112,70 @@ def test_parse_line_numbers():
     additions = [c for c in result[0].changes if c.type == "addition"]
     assert additions[0].line == 11
     assert additions[1].line == 12
+
+
+def test_format_diff_context():
+    """Test rendering structured changes as agent prompt text."""
+    files = [
+        {
+            "file": "app.py",
+            "changes": [
+                {"type": "context", "line": 4, "content": "def process():"},
+                {"type": "deletion", "line": None, "content": "    old = 1"},
+                {"type": "addition", "line": 5, "content": "    new = 2"},
+            ],
+        }
+    ]
+    context = format_diff_context(files)
+    
+    assert context == (
+        "Code changes to review:\n\n"
+        "File: app.py\n"
+        "Changes:\n"
+        "  Line None (-):     old = 1\n"
+        "  Line 5 (+):     new = 2\n"
+        "\n"
+    )
+
+
+def test_has_binary_markers():
+    """Test binary marker detection only at line starts."""
+    binary = """diff --git a/image.png b/image.png
+Binary files a/image.png and b/image.png differ
+"""
+    text = """diff --git a/app.py b/app.py
++++ b/app.py
+@@ -1,1 +1,2 @@
+ x = 1
++msg = "Binary files are skipped"
+"""
+    assert has_binary_markers(binary)
+    assert has_binary_markers("GIT binary patch\nliteral 0\n")
+    assert not has_binary_markers(text)
+
+
+def test_parse_unified_diff_to_dict_matches_dataclasses():
+    """Test the dict payload mirrors the dataclass parse."""
+    diff = """diff --git a/app.py b/app.py
+--- a/app.py
++++ b/app.py
+@@ -3,2 +3,2 @@
+ keep = 0
+-old = 1
++new = 2
+"""
+    payload = parse_unified_diff_to_dict(diff)
+    
+    assert payload == {
+        "files": [
+            {
+                "file": fd.file,
+                "changes": [
+                    {"type": c.type, "line": c.line, "content": c.content}
+                    for c in fd.changes
+                ],
+            }
+            for fd in parse_unified_diff(diff)
+        ]
+    }
+    assert payload["files"][0]["changes"][2] == {"type": "addition", "line": 4, "content": "new = 2"}
@@ -1,8 +1,12 @@
 """Unit tests for GitHub API service."""
 
+import asyncio
+
 import pytest
-from unittest.mock import AsyncMock, patch, MagicMock
+from cachetools import TTLCache
+from src.services import github_service
 from src.services.github_service import (
+    _etag_cache,
     fetch_pr_diff,
     PRNotFoundError,
     InvalidTokenError,
@@ -13,86 +17,101 @@ from src.services.github_service import (
 )
 import httpx
 
+PR_URL = "https://api.github.com/repos/owner/repo/pulls/123"
+
+
+@pytest.fixture(autouse=True)
+def clear_etag_cache():
+    """Keep cached diffs and the shared client from leaking between tests."""
+    _etag_cache.clear()
+    github_service._client = None
+    yield
+    _etag_cache.clear()
+    github_service._client = None
+
+
+def _run(coro):
+    """Drive a coroutine to completion without the pytest-asyncio plugin."""
+    return asyncio.run(coro)
+
 
-@pytest.mark.asyncio
-async def test_fetch_pr_diff_success():
-    """Test successful PR diff fetch."""
-    mock_response = MagicMock()
-    mock_response.status_code = 200
-    mock_response.text = """diff --git a/test.py b/test.py
---- a/test.py
-+++ b/test.py
-@@ -1,1 +1,2 @@
- original
-+new line
-"""
+# fetch_pr_diff only checks for emptiness and binary markers, not diff structure
+DIFF_OK = "diff --git a/x b/x\n+new line\n"
+
+BINARY_DIFF = "Binary files a/x and b/x differ\n"
+
+# status, body, expected exception, substrings expected in the result or error
+CASES = [
+    pytest.param(200, DIFF_OK, None, ("diff --git", "new line"), id="success"),
+    pytest.param(404, "", PRNotFoundError, ("not found",), id="not_found"),
+    pytest.param(401, "", InvalidTokenError, ("token",), id="invalid_token"),
+    pytest.param(200, "", EmptyPRError, (), id="empty"),
+    pytest.param(200, BINARY_DIFF, BinaryDiffError, (), id="binary_files"),
+]
+
+
+@pytest.mark.parametrize("status,text,exc,contains", CASES)
+def test_fetch_pr_diff(respx_mock, status, text, exc, contains):
+    """Test fetch_pr_diff results and error mapping per GitHub response."""
+    respx_mock.get(PR_URL).mock(return_value=httpx.Response(status, text=text))
     
-    with patch("httpx.AsyncClient") as mock_client:
-        mock_client.return_value.__aenter__.return_value.get = AsyncMock(return_value=mock_response)
-        
-        result = await fetch_pr_diff("owner", "repo", 123, "fake_token")
-        
-        assert "diff --git" in result
-        assert "new line" in result
-
-
-@pytest.mark.asyncio
-async def test_fetch_pr_diff_not_found():
-    """Test PR not found error."""
-    mock_response = MagicMock()
-    mock_response.status_code = 404
+    if exc is None:
+        result = _run(fetch_pr_diff("owner", "repo", 123, "fake_token"))
+    else:
+        with pytest.raises(exc) as exc_info:
+            _run(fetch_pr_diff("owner", "repo", 123, "fake_token"))
+        result = str(exc_info.value).lower()
     
-    with patch("httpx.AsyncClient") as mock_client:
-        mock_get = AsyncMock(side_effect=httpx.HTTPStatusError("Not Found", request=MagicMock(), response=mock_response))
-        mock_client.return_value.__aenter__.return_value.get = mock_get
-        
-        with pytest.raises(PRNotFoundError) as exc_info:
-            await fetch_pr_diff("owner", "repo", 999, "fake_token")
-        
-        assert "not found" in str(exc_info.value).lower()
-
-
-@pytest.mark.asyncio
-async def test_fetch_pr_diff_invalid_token():
-    """Test invalid token error."""
-    mock_response = MagicMock()
-    mock_response.status_code = 401
+    for fragment in contains:
+        assert fragment in result
+
+
+def test_fetch_pr_diff_uses_etag_cache(respx_mock):
+    """Test that a 304 response returns the previously fetched diff."""
+    route = respx_mock.get(PR_URL).mock(side_effect=[
+        httpx.Response(200, text=DIFF_OK, headers={"ETag": '"abc123"'}),
+        httpx.Response(304),
+    ])
     
-    with patch("httpx.AsyncClient") as mock_client:
-        mock_get = AsyncMock(side_effect=httpx.HTTPStatusError("Unauthorized", request=MagicMock(), response=mock_response))
-        mock_client.return_value.__aenter__.return_value.get = mock_get
-        
-        with pytest.raises(InvalidTokenError) as exc_info:
-            await fetch_pr_diff("owner", "repo", 123, "invalid_token")
-        
-        assert "token" in str(exc_info.value).lower()
-
-
-@pytest.mark.asyncio
-async def test_fetch_pr_diff_empty():
-    """Test empty PR detection."""
-    mock_response = MagicMock()
-    mock_response.status_code = 200
-    mock_response.text = ""
+    async def fetch_twice():
+        # One loop for both calls, since they share the module's client
+        first = await fetch_pr_diff("owner", "repo", 123, "fake_token")
+        return first, await fetch_pr_diff("owner", "repo", 123, "fake_token")
     
-    with patch("httpx.AsyncClient") as mock_client:
-        mock_client.return_value.__aenter__.return_value.get = AsyncMock(return_value=mock_response)
-        
-        with pytest.raises(EmptyPRError):
-            await fetch_pr_diff("owner", "repo", 123, "fake_token")
-
-
-@pytest.mark.asyncio
-async def test_fetch_pr_diff_binary_files():
-    """Test binary files detection."""
-    mock_response = MagicMock()
-    mock_response.status_code = 200
-    mock_response.text = """diff --git a/image.png b/image.png
-Binary files a/image.png and b/image.png differ
-"""
+    first, second = _run(fetch_twice())
     
-    with patch("httpx.AsyncClient") as mock_client:
-        mock_client.return_value.__aenter__.return_value.get = AsyncMock(return_value=mock_response)
-        
-        with pytest.raises(BinaryDiffError):
-            await fetch_pr_diff("owner", "repo", 123, "fake_token")
+    assert second == first
+    assert route.calls.last.request.headers["If-None-Match"] == '"abc123"'
+
+
+def test_fetch_pr_diff_304_refreshes_cache_ttl(respx_mock, monkeypatch):
+    """Test that a revalidated diff stays cached past its original expiry."""
+    now = [0.0]
+    cache = TTLCache(maxsize=1024, ttl=100, timer=lambda: now[0], getsizeof=lambda entry: len(entry[1]))
+    monkeypatch.setattr(github_service, "_etag_cache", cache)
+    respx_mock.get(PR_URL).mock(side_effect=[
+        httpx.Response(200, text=DIFF_OK, headers={"ETag": '"abc123"'}),
+        httpx.Response(304),
+    ])
+
+    async def fetch_twice():
+        await fetch_pr_diff("owner", "repo", 123, "fake_token")
+        now[0] = 90.0
+        await fetch_pr_diff("owner", "repo", 123, "fake_token")
+
+    _run(fetch_twice())
+    now[0] = 150.0
+
+    assert ("owner", "repo", 123) in cache
+
+
+def test_fetch_pr_diff_skips_caching_oversized_diff(respx_mock, monkeypatch):
+    """Test that a diff larger than the cache budget is not cached."""
+    monkeypatch.setattr(github_service, "_ETAG_CACHE_MAX_CHARS", len(DIFF_OK) - 1)
+    respx_mock.get(PR_URL).mock(
+        return_value=httpx.Response(200, text=DIFF_OK, headers={"ETag": '"abc123"'})
+    )
+
+    _run(fetch_pr_diff("owner", "repo", 123, "fake_token"))
+
+    assert len(_etag_cache) == 0
@@ -0,0 +1,39 @@
+"""Unit tests for LLM JSON extraction."""
+
+import pytest
+from src.utils.json_extract import extract_json, loads_llm_json
+
+
+def test_extract_fenced_json():
+    """Test extracting a ```json fenced block."""
+    text = 'Here are the findings:\n```json\n[{"line": 1}]\n```\nDone.'
+    assert extract_json(text) == '[{"line": 1}]'
+
+
+def test_extract_unfenced_array_and_object():
+    """Test falling back to the outermost array or object."""
+    assert extract_json('Findings: [{"line": 1}] end') == '[{"line": 1}]'
+    assert extract_json('{"comments": []}') == '{"comments": []}'
+
+
+def test_loads_llm_json():
+    """Test decoding the extracted payload."""
+    assert loads_llm_json('```json\n{"comments": [{"line": 3}]}\n```') == {"comments": [{"line": 3}]}
+
+
+def test_loads_llm_json_invalid():
+    """Test that non-JSON output raises ValueError."""
+    with pytest.raises(ValueError):
+        loads_llm_json("This is not valid JSON")
+
+
+def test_loads_llm_json_backticks_inside_string():
+    """Test that ``` inside a JSON string value does not end the fence."""
+    text = (
+        '```json\n'
+        '[{"file": "a.py", "line": 2, "recommendation": "Use ```with open(p) as f:```"}]\n'
+        '```'
+    )
+    assert loads_llm_json(text) == [
+        {"file": "a.py", "line": 2, "recommendation": "Use ```with open(p) as f:```"}
+    ]
@@ -0,0 +1,94 @@
+"""Unit tests for the LLM response cache."""
+
+import pytest
+from src.services.llm_cache import InMemoryLRUBackend, LLMCache, RedisBackend
+
+
+def test_make_key_is_deterministic():
+    """Test that identical inputs produce the same cache key."""
+    key1 = LLMCache.make_key("Security Reviewer", "model", "prompt")
+    key2 = LLMCache.make_key("Security Reviewer", "model", "prompt")
+    other = LLMCache.make_key("Logic & Bug Reviewer", "model", "prompt")
+
+    assert key1 == key2
+    assert key1 != other
+
+
+@pytest.mark.asyncio
+async def test_cache_hit_and_miss_stats():
+    """Test that hits and misses are counted."""
+    cache = LLMCache(InMemoryLRUBackend())
+
+    assert await cache.get("key") is None
+    await cache.set("key", "[]")
+    assert await cache.get("key") == "[]"
+
+    assert cache.stats() == {"cache_hits": 1, "cache_misses": 1}
+
+
+@pytest.mark.asyncio
+async def test_in_memory_backend_evicts_least_recently_used():
+    """Test LRU eviction once max_entries is exceeded."""
+    backend = InMemoryLRUBackend(max_entries=2)
+
+    await backend.set("a", "1")
+    await backend.set("b", "2")
+    await backend.get("a")
+    await backend.set("c", "3")
+
+    assert await backend.get("a") == "1"
+    assert await backend.get("b") is None
+    assert await backend.get("c") == "3"
+
+
+@pytest.mark.asyncio
+async def test_backend_failure_is_treated_as_miss():
+    """Test that backend errors do not propagate."""
+    class BrokenBackend:
+        async def get(self, key):
+            raise ConnectionError("redis down")
+
+        async def set(self, key, value, ttl=None):
+            raise ConnectionError("redis down")
+
+    cache = LLMCache(BrokenBackend())
+
+    await cache.set("key", "[]")
+    assert await cache.get("key") is None
+    assert cache.misses == 1
+
+
+@pytest.mark.asyncio
+async def test_redis_backend_reuses_one_client(monkeypatch):
+    """Test that RedisBackend opens one pooled client instead of one per call."""
+    from redis.asyncio import Redis
+
+    class FakeRedis:
+        def __init__(self):
+            self.store = {}
+            self.closed = False
+
+        async def get(self, key):
+            return self.store.get(key)
+
+        async def set(self, key, value, ex=None):
+            self.store[key] = value
+
+        async def aclose(self):
+            self.closed = True
+
+    clients = []
+
+    def fake_from_url(url, **kwargs):
+        clients.append(FakeRedis())
+        return clients[-1]
+
+    monkeypatch.setattr(Redis, "from_url", fake_from_url)
+    backend = RedisBackend("redis://localhost")
+
+    await backend.set("key", "[]")
+    assert await backend.get("key") == "[]"
+    await LLMCache(backend).close()
+
+    assert len(clients) == 1
+    assert clients[0].closed
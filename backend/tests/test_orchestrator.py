@@ -1,26 +1,20 @@
 """Unit tests for orchestrator."""
 
+import asyncio
+import functools
+from types import SimpleNamespace
+
 import pytest
 from unittest.mock import patch, MagicMock
-from src.services.orchestrator import run_review_pipeline
-
-
-def test_run_review_pipeline_basic():
-    """Test basic orchestrator execution."""
-    structured_diff = {
-        "files": [
-            {
-                "file": "test.py",
-                "changes": [
-                    {"type": "addition", "line": 10, "content": "    x = 1"}
-                ]
-            }
-        ]
-    }
-    
-    # Mock CrewAI's Crew.kickoff to return a JSON response
-    mock_result = MagicMock()
-    mock_result.__str__ = lambda self: '''```json
+from src.services.llm_cache import llm_cache
+from src.utils import json_extract
+from src.utils.diff_parser import format_diff_context
+from src.services import orchestrator
+from src.services.orchestrator import _chunk_diff, _dedupe_comments, run_review_pipeline
+
+
+# Canned LLM outputs, built once at import
+_BASIC_JSON = '''```json
 {
     "comments": [
         {
@@ -34,89 +28,12 @@ def test_run_review_pipeline_basic():
     ]
 }
 ```'''
-    
-    with patch("src.services.orchestrator.build_review_crew") as mock_build:
-        mock_crew = MagicMock()
-        mock_crew.kickoff.return_value = mock_result
-        mock_build.return_value = mock_crew
-        
-        result = run_review_pipeline(structured_diff)
-        
-        assert "comments" in result
-        assert len(result["comments"]) == 1
-        assert result["comments"][0]["file"] == "test.py"
-        assert result["comments"][0]["severity"] == "low"
-
-
-def test_run_review_pipeline_empty_response():
-    """Test orchestrator handling empty LLM response."""
-    structured_diff = {
-        "files": [
-            {
-                "file": "empty.py",
-                "changes": []
-            }
-        ]
-    }
-    
-    mock_result = MagicMock()
-    mock_result.__str__ = lambda self: '{"comments": []}'
-    
-    with patch("src.services.orchestrator.build_review_crew") as mock_build:
-        mock_crew = MagicMock()
-        mock_crew.kickoff.return_value = mock_result
-        mock_build.return_value = mock_crew
-        
-        result = run_review_pipeline(structured_diff)
-        
-        assert "comments" in result
-        assert len(result["comments"]) == 0
-
-
-def test_run_review_pipeline_invalid_json():
-    """Test orchestrator handling invalid JSON from LLM."""
-    structured_diff = {
-        "files": [
-            {
-                "file": "test.py",
-                "changes": [
-                    {"type": "addition", "line": 5, "content": "code"}
-                ]
-            }
-        ]
-    }
-    
-    mock_result = MagicMock()
-    mock_result.__str__ = lambda self: "This is not valid JSON"
-    
-    with patch("src.services.orchestrator.build_review_crew") as mock_build:
-        mock_crew = MagicMock()
-        mock_crew.kickoff.return_value = mock_result
-        mock_build.return_value = mock_crew
-        
-        result = run_review_pipeline(structured_diff)
-        
-        # Should return empty comments on parse failure
-        assert "comments" in result
-        assert len(result["comments"]) == 0
-
-
-def test_run_review_pipeline_multiple_issues():
-    """Test orchestrator with multiple review comments."""
-    structured_diff = {
-        "files": [
-            {
-                "file": "app.py",
-                "changes": [
-                    {"type": "addition", "line": 15, "content": "    password = '123'"},
-                    {"type": "addition", "line": 20, "content": "    for i in range(n):"}
-                ]
-            }
-        ]
-    }
-    
-    mock_result = MagicMock()
-    mock_result.__str__ = lambda self: '''```json
+
+_EMPTY_JSON = '{"comments": []}'
+
+_INVALID_JSON = "This is not valid JSON"
+
+_MULTI_JSON = '''```json
 {
     "comments": [
         {
@@ -138,16 +55,342 @@ def test_run_review_pipeline_multiple_issues():
     ]
 }
 ```'''
+
+class _StrResult:
+    """Stands in for a CrewOutput; the pipeline only calls str() on it."""
+    __slots__ = ("s",)
     
-    with patch("src.services.orchestrator.build_review_crew") as mock_build:
-        mock_crew = MagicMock()
-        mock_crew.kickoff.return_value = mock_result
-        mock_build.return_value = mock_crew
-        
-        result = run_review_pipeline(structured_diff)
+    def __init__(self, s):
+        self.s = s
+    
+    def __str__(self):
+        return self.s
+
+
+# Structured diffs fed to the pipeline; read-only, so shared by every test
+_DIFF_BASIC = {"files": [{"file": "test.py", "changes": [
+    {"type": "addition", "line": 10, "content": "    x = 1"},
+]}]}
+
+# Has an added line so the agents run and their empty findings are parsed
+_DIFF_EMPTY = {"files": [{"file": "empty.py", "changes": [
+    {"type": "addition", "line": 1, "content": "pass"},
+]}]}
+
+_DIFF_SINGLE_LINE = {"files": [{"file": "test.py", "changes": [
+    {"type": "addition", "line": 5, "content": "code"},
+]}]}
+
+_DIFF_MULTI = {"files": [{"file": "app.py", "changes": [
+    {"type": "addition", "line": 15, "content": "    password = '123'"},
+    {"type": "addition", "line": 20, "content": "    for i in range(n):"},
+]}]}
+
+_DIFF_DELETION_ONLY = {"files": [{"file": "old.py", "changes": [
+    {"type": "deletion", "line": None, "content": "    unused = True"},
+]}]}
+
+
+@pytest.fixture(scope="module", autouse=True)
+def cache_json_extraction():
+    """Memoize fence stripping for the few canned outputs these tests reuse.
+    
+    Caches the extracted text rather than the decoded JSON, since the pipeline
+    mutates the parsed findings.
+    """
+    cached = functools.lru_cache(maxsize=64)(json_extract.extract_json)
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(json_extract, "extract_json", cached)
+        yield
+
+
+@pytest.fixture
+def mock_kickoff(monkeypatch):
+    """Replace crew construction; tests set what the shared kickoff returns."""
+    kickoff = MagicMock()
+    crew = MagicMock()
+    crew.kickoff = kickoff
+    monkeypatch.setattr("src.services.orchestrator.build_review_crew", lambda *_: crew)
+    return kickoff
+
+
+@pytest.fixture(autouse=True)
+def clear_llm_cache():
+    """Keep cached agent output from leaking between tests."""
+    llm_cache.backend.clear()
+    yield
+    llm_cache.backend.clear()
+
+
+# structured diff, raw LLM output, expected (file, severity, source) per comment
+PIPELINE_CASES = [
+    pytest.param(
+        _DIFF_BASIC,
+        _BASIC_JSON,
+        [("test.py", "low", "readability")],
+        id="basic",
+    ),
+    pytest.param(
+        _DIFF_EMPTY,
+        _EMPTY_JSON,
+        [],
+        id="empty",
+    ),
+    # Unparseable output yields no comments rather than an error
+    pytest.param(
+        _DIFF_SINGLE_LINE,
+        _INVALID_JSON,
+        [],
+        id="invalid_json",
+    ),
+    pytest.param(
+        _DIFF_MULTI,
+        _MULTI_JSON,
+        [("app.py", "critical", "security"), ("app.py", "low", "readability")],
+        id="multi",
+        marks=pytest.mark.slow,
+    ),
+]
+
+
+@pytest.mark.parametrize("structured_diff,llm_output,expected", PIPELINE_CASES)
+def test_run_review_pipeline(mock_kickoff, structured_diff, llm_output, expected):
+    """Test orchestrator output for canned LLM responses."""
+    # Mock CrewAI's Crew.kickoff to return the canned response
+    mock_kickoff.return_value = _StrResult(llm_output)
+    
+    result = run_review_pipeline(structured_diff)
+    
+    mock_kickoff.assert_called()
+    assert "comments" in result
+    assert [(c["file"], c["severity"], c["source"]) for c in result["comments"]] == expected
+
+
+async def test_run_review_pipeline_parallel(monkeypatch):
+    """Run every PIPELINE_CASES row concurrently on worker threads.
+    
+    Quick bulk check for local runs without xdist; the parametrized test
+    keeps each case isolated.
+    """
+    # Slow rows stay in the parametrized test, where FAST_TESTS=1 can skip them
+    cases = [
+        param.values for param in PIPELINE_CASES
+        if not any(mark.name == "slow" for mark in param.marks)
+    ]
+    # Each fake crew answers with the canned output for the diff in its prompt
+    outputs = {format_diff_context(diff["files"]): llm_output for diff, llm_output, _ in cases}
+    
+    def fake_build_review_crew(agent, prompt, expected_output):
+        output = next(out for context, out in outputs.items() if context in prompt)
+        return SimpleNamespace(kickoff=lambda: _StrResult(output))
+    
+    monkeypatch.setattr("src.services.orchestrator.build_review_crew", fake_build_review_crew)
+    
+    results = await asyncio.gather(
+        *(asyncio.to_thread(run_review_pipeline, diff) for diff, _, _ in cases)
+    )
+    
+    for result, (_, _, expected) in zip(results, cases):
+        assert [(c["file"], c["severity"], c["source"]) for c in result["comments"]] == expected
+
+
+_COMBINED_JSON = """{
+    "readability": [
+        {"file": "app.py", "line": 20, "severity": "low", "issue": "Unclear name 'n'",
+         "recommendation": "Rename it"}
+    ],
+    "logic": [],
+    "performance": [],
+    "security": [
+        {"file": "app.py", "line": 15, "severity": "critical", "issue": "Hardcoded password",
+         "recommendation": "Use environment variables"}
+    ]
+}"""
+
+# Wrong shapes per aspect: strings, a bare object, a null
+_MALFORMED_COMBINED_JSON = """{
+    "readability": ["bad"],
+    "logic": {"file": "app.py", "line": 1},
+    "performance": null,
+    "security": [
+        "also bad",
+        {"file": "app.py", "line": 15, "severity": "critical", "issue": "Hardcoded password",
+         "recommendation": "Use environment variables"}
+    ]
+}"""
+
+
+@pytest.mark.parametrize("llm_output,expected", [
+    pytest.param(
+        _COMBINED_JSON,
+        [("app.py", "low", "readability"), ("app.py", "critical", "security")],
+        id="combined",
+    ),
+    pytest.param(
+        _MALFORMED_COMBINED_JSON,
+        [("app.py", "critical", "security")],
+        id="malformed",
+    ),
+])
+def test_run_review_pipeline_marshaled_prompt(mock_kickoff, monkeypatch, llm_output, expected):
+    """Test the single combined-prompt path tags sources and skips malformed entries."""
+    monkeypatch.setattr("src.services.orchestrator.USE_MARSHALED_PROMPT", True)
+    mock_kickoff.return_value = _StrResult(llm_output)
+    
+    result = run_review_pipeline(_DIFF_MULTI)
+    
+    assert mock_kickoff.call_count == 1
+    assert [(c["file"], c["severity"], c["source"]) for c in result["comments"]] == expected
+
+
+_BOGUS_SEVERITY_JSON = _BASIC_JSON.replace('"severity": "low"', '"severity": "bogus"')
+
+
+@pytest.mark.parametrize("bad_output", [
+    pytest.param(_BOGUS_SEVERITY_JSON, id="invalid_severity"),
+    pytest.param(_INVALID_JSON, id="unparseable"),
+])
+def test_run_review_pipeline_does_not_cache_bad_output(mock_kickoff, bad_output):
+    """Test that a bad LLM answer is not replayed from cache once the LLM recovers."""
+    mock_kickoff.return_value = _StrResult(bad_output)
+    run_review_pipeline(_DIFF_BASIC)
+    
+    mock_kickoff.return_value = _StrResult(_BASIC_JSON)
+    result = run_review_pipeline(_DIFF_BASIC)
+    
+    assert [(c["file"], c["severity"], c["source"]) for c in result["comments"]] == [
+        ("test.py", "low", "readability")
+    ]
+    
+    # The good answer is cached
+    calls = mock_kickoff.call_count
+    run_review_pipeline(_DIFF_BASIC)
+    assert mock_kickoff.call_count == calls
+
+
+def test_run_review_pipeline_skips_diff_without_additions():
+    """Test that no agents run when a diff only deletes code."""
+    with patch("src.services.orchestrator._run_single_agent_task_async") as mock_run:
+        result = run_review_pipeline(_DIFF_DELETION_ONLY)
         
-        assert len(result["comments"]) == 2
-        assert result["comments"][0]["severity"] == "critical"
-        assert result["comments"][0]["source"] == "security"
-        assert result["comments"][1]["severity"] == "low"
-        assert result["comments"][1]["source"] == "readability"
+        assert result == {"comments": []}
+        mock_run.assert_not_called()
+
+
+def test_chunk_diff_splits_on_file_boundaries():
+    """Test that large diffs are split into whole-file chunks."""
+    files = [
+        {
+            "file": f"module_{i}.py",
+            "changes": [
+                {"type": "addition", "line": n, "content": f"    value_{n} = compute({n})"}
+                for n in range(1, 101)
+            ]
+        }
+        for i in range(3)
+    ]
+    
+    chunks = _chunk_diff({"files": files}, max_tokens=2000)
+    
+    assert len(chunks) == 3
+    assert [c["files"][0]["file"] for c in chunks] == ["module_0.py", "module_1.py", "module_2.py"]
+    assert _chunk_diff({"files": files}, max_tokens=100_000) == [{"files": files}]
+
+
+def test_load_tokenizer_retries_after_failure(monkeypatch):
+    """Test that a failed tokenizer load is not cached for good."""
+    encoding = object()
+    calls = []
+
+    def fake_encoding_for_model(model):
+        calls.append(model)
+        if len(calls) == 1:
+            raise ConnectionError("offline")
+        return encoding
+
+    monkeypatch.setattr(orchestrator.tiktoken, "encoding_for_model", fake_encoding_for_model)
+    monkeypatch.setattr(orchestrator, "_encoding", None)
+    monkeypatch.setattr(orchestrator, "_encoding_retry_at", 0.0)
+
+    assert orchestrator.load_tokenizer() is None
+    # Within the retry window the failure is not retried
+    assert orchestrator.load_tokenizer() is None
+    assert len(calls) == 1
+
+    monkeypatch.setattr(orchestrator, "_encoding_retry_at", 0.0)
+    assert orchestrator.load_tokenizer() is encoding
+    assert orchestrator.load_tokenizer() is encoding
+    assert len(calls) == 2
+
+
+def test_dedupe_comments_ignores_whitespace_and_case():
+    """Test that near-identical issue wording from different agents is merged."""
+    comments = [
+        {"file": "app.py", "line": 3, "issue": "Hardcoded  password", "source": "security"},
+        {"file": "app.py", "line": 3, "issue": "hardcoded password ", "source": "logic"},
+        {"file": "app.py", "line": 4, "issue": "Hardcoded password", "source": "security"},
+    ]
+    
+    result = _dedupe_comments(comments)
+    
+    assert [c["line"] for c in result] == [3, 4]
+    assert result[0]["source"] == "security"
+
+
+def test_dedupe_comments_tolerates_unhashable_fields():
+    """Test that list-valued file or line fields do not break deduplication."""
+    comments = [
+        {"file": "app.py", "line": [1], "issue": "Bad line"},
+        {"file": "app.py", "line": [1], "issue": "Bad line"},
+        {"file": ["app.py"], "line": 2, "issue": "Bad file"},
+    ]
+
+    assert len(_dedupe_comments(comments)) == 2
+
+
+@pytest.mark.parametrize("failure", [
+    pytest.param(RuntimeError("LLM down"), id="raises"),
+    pytest.param('{"summary": "nothing to merge"}', id="no-list"),
+    pytest.param('[{"file": "a.py", "line": 1, "severity": "Critical", "issue": "x"}]', id="invalid-findings"),
+])
+async def test_consolidate_with_llm_keeps_input_on_failure(mock_kickoff, failure):
+    """Test that a failed, listless or invalid consolidation returns the merged findings unchanged."""
+    comments = [{"file": "app.py", "line": 3, "issue": "Hardcoded password", "source": "security"}]
+    if isinstance(failure, Exception):
+        mock_kickoff.side_effect = failure
+    else:
+        mock_kickoff.return_value = _StrResult(failure)
+
+    assert await orchestrator._consolidate_with_llm(comments) is comments
+    mock_kickoff.assert_called_once()
+
+
+def test_run_review_pipeline_decodes_each_answer_once(mock_kickoff, monkeypatch):
+    """Test that each agent answer is decoded once, not again for caching or parsing."""
+    decoded = []
+    real_loads = orchestrator.loads_llm_json
+
+    def counting_loads(text):
+        decoded.append(text)
+        return real_loads(text)
+
+    monkeypatch.setattr(orchestrator, "loads_llm_json", counting_loads)
+    mock_kickoff.return_value = _StrResult(_BASIC_JSON)
+
+    run_review_pipeline(_DIFF_BASIC)
+
+    assert len(decoded) == mock_kickoff.call_count == 4
+
+
+def test_agent_pool_is_recreated_after_shutdown(mock_kickoff):
+    """Test that a second app lifespan can still run reviews after the pool shut down."""
+    mock_kickoff.return_value = _StrResult(_BASIC_JSON)
+    run_review_pipeline(_DIFF_BASIC)
+
+    orchestrator.shutdown_agent_pool()
+    llm_cache.backend.clear()
+
+    result = run_review_pipeline(_DIFF_BASIC)
+    assert [(c["file"], c["severity"], c["source"]) for c in result["comments"]] == [
+        ("test.py", "low", "readability")
+    ]
@@ -0,0 +1,57 @@
+"""Unit tests for LLM rate limiting."""
+
+import time
+
+import httpx
+import pytest
+from openai import RateLimitError
+from src.services.rate_limiter import AsyncLimiter, llm_retry, retry_after_seconds
+
+
+def _rate_limit_error(headers=None):
+    request = httpx.Request("POST", "https://openrouter.ai/api/v1/chat/completions")
+    response = httpx.Response(429, headers=headers or {}, request=request)
+    return RateLimitError("Rate limit exceeded", response=response, body=None)
+
+
+@pytest.mark.asyncio
+async def test_limiter_allows_burst_then_waits():
+    """Test that acquisitions beyond max_rate are delayed."""
+    limiter = AsyncLimiter(max_rate=2, time_period=0.2)
+    
+    start = time.monotonic()
+    async with limiter:
+        pass
+    async with limiter:
+        pass
+    burst_time = time.monotonic() - start
+    
+    async with limiter:
+        pass
+    total_time = time.monotonic() - start
+    
+    assert burst_time < 0.05
+    assert total_time >= 0.09
+
+
+def test_retry_after_seconds_reads_header():
+    """Test parsing the Retry-After header from a rate limit error."""
+    assert retry_after_seconds(_rate_limit_error({"retry-after": "3"})) == 3.0
+    assert retry_after_seconds(_rate_limit_error()) is None
+    assert retry_after_seconds(ValueError("boom")) is None
+
+
+@pytest.mark.asyncio
+async def test_llm_retry_retries_rate_limit_errors():
+    """Test that rate limit errors are retried until the call succeeds."""
+    calls = []
+    
+    @llm_retry
+    async def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise _rate_limit_error({"retry-after": "0"})
+        return "[]"
+    
+    assert await flaky() == "[]"
+    assert len(calls) == 3
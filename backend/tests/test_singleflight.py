@@ -0,0 +1,61 @@
+"""Unit tests for singleflight request coalescing."""
+
+import asyncio
+
+import pytest
+from src.utils.singleflight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_share_one_execution():
+    """Test that concurrent callers with the same key run the work once."""
+    flight = SingleFlight()
+    calls = []
+    
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+    
+    results = await asyncio.gather(*[flight.do("pr#1", work) for _ in range(5)])
+    
+    assert results == ["result"] * 5
+    assert len(calls) == 1
+    assert len(flight) == 0
+
+
+@pytest.mark.asyncio
+async def test_errors_propagate_to_all_waiters():
+    """Test that a failed execution raises in every caller and is not cached."""
+    flight = SingleFlight()
+    
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+    
+    results = await asyncio.gather(
+        flight.do("pr#1", fail), flight.do("pr#1", fail), return_exceptions=True
+    )
+    
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert len(flight) == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelling_first_caller_does_not_cancel_others():
+    """Test that waiters still get the result when the first caller is cancelled."""
+    flight = SingleFlight()
+    
+    async def work():
+        await asyncio.sleep(0.02)
+        return "result"
+    
+    leader = asyncio.create_task(flight.do("pr#1", work))
+    await asyncio.sleep(0)
+    follower = asyncio.create_task(flight.do("pr#1", work))
+    await asyncio.sleep(0)
+    leader.cancel()
+    
+    assert await follower == "result"
+    assert leader.cancelled()
+    assert len(flight) == 0